@@ -7,7 +7,8 @@ Copyright (c) 2021 Roi ZHAO
 
 '''
 
-from .rquote import get_price, get_stock_concepts, get_concept_stocks
+from .rquote import get_price, get_prices, get_stock_concepts, get_concept_stocks
+from .rquote import clear_cache
 from .rquote import get_all_concepts, get_all_industries
 from .utils import CommonUtils, WebUtils, BasicFactors, DataFormatter, reqget
 from .plots import PlotUtils
@@ -2,20 +2,48 @@
 
 import os
 import time
-import logging
-import plotly.graph_objs as go
-from .rquote import get_price
-# logging.getLogger().setLevel(logging.INFO)
-logging.basicConfig(filename='/tmp/rquote.log',
-                    format='%(asctime)-15s:%(lineno)s %(message)s',
-                    level=logging.INFO)
+import numpy as np
+try:
+    import plotly.graph_objs as go
+except ImportError:
+    # plotting is optional, the rest of rquote works without plotly
+    go = None
+from .rquote import get_price, get_prices
+
+# how to merge consecutive bars into one
+_OHLCV_AGG = {'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last',
+              'vol': 'sum'}
+
+
+def _downsample(v, max_points):
+    '''
+    Merge every k consecutive bars so that at most `max_points` remain,
+    each labelled by the date of its first bar
+    '''
+    if not max_points or len(v) <= max_points:
+        return v
+    k = -(-len(v) // max_points)
+    pos = np.arange(len(v))
+    d = v.groupby(pos // k).agg(
+        {c: f for c, f in _OHLCV_AGG.items() if c in v.columns})
+    d.index = v.index[::k]
+    return d
+
+
 class PlotUtils:
-    def plot_candle(i, sdate='', edate='', dsh=False, vol=True):
+    def plot_candle(i, sdate='', edate='', dsh=False, vol=True, max_points=1000,
+                    min_gl_rows=500):
         '''
             Plot candles of i
             Input: id
+                max_points: merge bars to keep at most this many candles,
+                    None for all of them
+                min_gl_rows: draw volume with webgl above this many rows,
+                    keep it below max_points or webgl is never used
             Output: plotting data and default layout
         '''
+        if go is None:
+            raise ImportError('plot_candle requires plotly, pip install plotly')
         layout = go.Layout(
             barmode = 'stack',
             xaxis = dict(
@@ -27,17 +55,33 @@ class PlotUtils:
         
         dt = []
         icolor, dcolor = 'red', 'green'
-        _, n, v = get_price(i, sdate=sdate, edate=edate)
-        v = (v - v.low.min()) * 10 / (v.high.max() - v.low.min()) + 2
-        v = v.round(3) # compress html data
+        if dsh:
+            # fetch the sh index alongside i rather than after it
+            (_, n, v), (_, _, vsh) = get_prices(
+                [i, 'sh000001'], sdate=sdate, edate=edate, workers=2)
+        else:
+            _, n, v = get_price(i, sdate=sdate, edate=edate)
+        if not len(v):
+            return dt, layout
+        vi = v.index
+        v = _downsample(v, max_points)
+        # scale prices into [2, 12] in place on one float64 array
+        x = v.index.to_numpy()
+        prices = v[['open', 'high', 'low', 'close']].to_numpy(
+            dtype=np.float64, copy=True)
+        lo, hi = np.nanmin(prices), np.nanmax(prices)
+        prices -= lo
+        prices *= 10 / (hi - lo)
+        prices += 2
+        np.round(prices, 3, out=prices) # compress html data
         
         dt += [
                 go.Candlestick(
-                        x=v.index.to_series(),
-                        open=v.open,
-                        high=v.high,
-                        low=v.low,
-                        close=v.close,
+                        x=x,
+                        open=prices[:, 0],
+                        high=prices[:, 1],
+                        low=prices[:, 2],
+                        close=prices[:, 3],
                         opacity=0.5,
                         hoverinfo='none',
                         name=n,
@@ -47,21 +91,37 @@ class PlotUtils:
             ]
         
         if vol:
-            vvol = v.vol / v.vol.max()
-            vvol *= 2
-            dt += [go.Bar(x = v.index.to_series(), y=vvol, name='vol', opacity=0.5)]
+            vvol = v.vol.to_numpy(dtype=np.float64, copy=True)
+            vvol *= 2 / np.nanmax(vvol)
+            np.round(vvol, 3, out=vvol)
+            if len(v) > min_gl_rows:
+                # svg bars get slow to pan with many rows, webgl area does not
+                dt += [go.Scattergl(x=x, y=vvol, fill='tozeroy', mode='none',
+                                    name='vol', opacity=0.5)]
+            else:
+                dt += [go.Bar(x = x, y=vvol, name='vol', opacity=0.5)]
             
         icolor, dcolor = 'cyan', 'gray'
         if dsh:
-            _, _, dsh = get_price('sh000001', sdate=sdate, edate=edate)
-            dsh = (dsh / dsh.iloc[0,0] - 1) * 10
+            if not len(vsh):
+                # failed sh fetches come back as a bare empty frame
+                return dt, layout
+            if len(v) < len(vi):
+                # the x axis is categorical, merge sh on the same bars and
+                # labels as i so that both share their categories
+                vsh = _downsample(vsh.reindex(vi), max_points)
+            # reindexing may leave leading gaps, start from the first open
+            base = vsh.open.dropna()
+            if not len(base):
+                return dt, layout
+            dsh = (vsh / base.iloc[0] - 1) * 10
             dt += [
                     go.Candlestick(
-                            x=dsh.index.to_series(),
-                            open=dsh.open,
-                            high=dsh.high,
-                            low=dsh.low,
-                            close=dsh.close,
+                            x=dsh.index.to_numpy(),
+                            open=dsh.open.to_numpy(),
+                            high=dsh.high.to_numpy(),
+                            low=dsh.low.to_numpy(),
+                            close=dsh.close.to_numpy(),
                             opacity=0.5,
                             hoverinfo='none',
                             name='sh',
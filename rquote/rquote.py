@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+import io
 import os
 import requests
 import json
@@ -9,12 +10,108 @@ import re
 import sys
 import base64
 import logging
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
-from .utils import WebUtils, reqget
-# logging.getLogger().setLevel(logging.INFO)
-logging.basicConfig(filename='/tmp/rquote.log',
-                    format='%(asctime)-15s:%(lineno)s %(message)s',
-                    level=logging.INFO)
+try:
+    import orjson as _json
+except ImportError:
+    _json = json
+from .utils import WebUtils, DataFormatter, LRUCache, SingleFlight, reqget
+
+# module logger to the shared log file, leaving the root logger to the app
+logger = logging.getLogger(__name__)
+if not logger.handlers:
+    hdl = logging.FileHandler('/tmp/rquote.log')
+    hdl.setFormatter(logging.Formatter('%(asctime)-15s:%(lineno)s %(message)s'))
+    logger.addHandler(hdl)
+    logger.setLevel(logging.INFO)
+
+# kline url of each market prefix, formatted with
+# symbol, freq, sdate, edate, days, fq
+_QTIMG_KLINE_URLS = {
+    'sh': 'http://web.ifzq.gtimg.cn/appstock/app/newfqkline/get?' +
+          'param={},{},{},{},{},{}',
+    'sz': 'http://web.ifzq.gtimg.cn/appstock/app/newfqkline/get?' +
+          'param={},{},{},{},{},{}',
+    'hk': 'http://web.ifzq.gtimg.cn/appstock/app/hkfqkline/get?' +
+          'param={},{},{},{},{},{}',
+    'us': 'http://web.ifzq.gtimg.cn/appstock/app/usfqkline/get?' +
+          'param={},{},{},{},{},{}',
+}
+# kline keys of qtimg kline response, in lookup order
+_QTIMG_KLINE_KEYS = ('day', 'qfqday', 'hfqday', 'week', 'qfqweek', 'hfqweek',
+                     'month', 'qfqmonth', 'hfqmonth')
+# same keys with those of the requested fq tried first
+_QTIMG_KLINE_KEYS_BY_FQ = {
+    fq: tuple(sorted(_QTIMG_KLINE_KEYS, key=lambda k: not k.startswith(fq)))
+    for fq in ('qfq', 'hfq')}
+
+# e.g. _SINA_FUTURE_D.format('FB0', 'FB0')
+_SINA_FUTURE_D = 'https://stock2.finance.sina.com.cn/futures/api/jsonp.php/' + \
+        'var%20t1nf_{}=/InnerFuturesNewService.getDailyKLine?symbol={}'
+# fields of its daily records, in column order
+_SINA_FUTURE_KEYS = ('d', 'o', 'h', 'l', 'c', 'v', 'p', 's')
+
+# e.g. _EAST_BK_KLINE.format('BK0420')
+_EAST_BK_KLINE = base64.b64decode('aHR0cDovL3B1c2gyaGlzLmVhc3' +
+        'Rtb25leS5jb20vYXBpL3F0L3N0b2NrL2tsaW5lL2dldD9jYj1qUX' +
+        'VlcnkxMTI0MDIyNTY2NDQ1ODczNzY2OTcyXzE2MTc4NjQ1NjgxMz' +
+        'Emc2VjaWQ9OTAu').decode() + '{}' + \
+        '&fields1=f1%2Cf2%2Cf3%2Cf4%2Cf5' + \
+        '&fields2=f51%2Cf52%2Cf53%2Cf54%2Cf55%2Cf56%2Cf57%2Cf58' + \
+        '&klt=101&fqt=0&beg=19900101&end=20990101&_=1'
+
+# cn stocks by amount, append a ms timestamp
+_EAST_CN_STOCKS = base64.b64decode('aHR0cDovLzM4LnB1c2gyLmVhc3Rtb25leS5jb20vYXBpL3F0L2Ns'+
+        'aXN0L2dldD9jYj1qUXVlcnkxMTI0MDk0NTg3NjE4NDQzNzQ4MDFfMTYyNzI4ODQ4O'+
+        'Tk2MSZwbj0xJnB6PTEwMDAwJnBvPTEmbnA9MSZ1dD1iZDFkOWRkYjA0MDg5NzAwY2'+
+        'Y5YzI3ZjZmNzQyNjI4MSZmbHR0PTImaW52dD0yJmZpZD1mNiZmcz1tOjArdDo2LG0'+
+        '6MCt0OjgwLG06MSt0OjIsbToxK3Q6MjMmZmllbGRzPWYxMixmMTQsZjMsZjYsZjIxJl89'
+        ).decode()
+
+_SINA_CN_FUNDS = base64.b64decode('aHR0cDovL3ZpcC5zdG9jay5maW5hbmNlLnNpbmEuY29tL'+
+        'mNuL3F1b3Rlc19zZXJ2aWNlL2FwaS9qc29ucC5waHAvSU8uWFNSVjIuQ2FsbGJhY2tMaX'+
+        'N0WydrMldhekswNk5Rd2xoeVh2J10vTWFya2V0X0NlbnRlci5nZXRIUU5vZGVEYXRhU2l'+
+        'tcGxlP3BhZ2U9MSZudW09MTAwMCZzb3J0PWFtb3VudCZhc2M9MCZub2RlPWV0Zl9ocV9m'+
+        'dW5kJiU1Qm9iamVjdCUyMEhUTUxEaXZFbGVtZW50JTVEPXhtNGkw').decode()
+
+# concepts of a stock, append code e.g. SH600000
+_EAST_F10_CONCEPTS = base64.b64decode('aHR0cDovL2YxMC5lYXN0bW9uZXkuY29tLy9Db3JlQ29uY2V' +
+        'wdGlvbi9Db3JlQ29uY2VwdGlvbkFqYXg/Y29kZT0=').decode()
+
+# e.g. _EAST_BK_STOCKS.format('BK0420')
+_EAST_BK_STOCKS = base64.b64decode('aHR0cDovL3B1c2gyLmVhc3Rtb25leS5jb20vYXBpL3F0L2NsaXN0' +
+        'L2dldD9jYj1qUXVlcnkxMTIzMDQwNTcwNTM4NTY5NDcwMTA1XzE2MTgwNDc5OTA2O' +
+        'TAmZmlkPWY2MiZwbz0xJnB6PTUwMCZwbj0xJm5wPTEmZmx0dD0yJmludnQ9MiZmcz' +
+        '1iJTNB').decode() + '{}' + '&fields=f3%2Cf6%2Cf12%2Cf14%2Cf21'
+
+_price_flight = SingleFlight()
+_price_cache = LRUCache(maxsize=128)
+# seconds to keep windows reaching today, absorbs bursts of repeated calls
+_OPEN_WINDOW_TTL = 30
+# adjusted history is rewritten on ex-dividend days, kept until the next day
+_ADJUSTED_FQ = frozenset(['qfq', 'hfq'])
+# seconds to remember failed fetches, so repeats in a batch skip the network
+_FAILED_TTL = 5
+# concepts of stocks and stocks of concepts, lists are copied in and out
+_concept_cache = LRUCache(maxsize=1024)
+# seconds to keep concept names of a stock, they change rarely
+_CONCEPT_TTL = 3600
+# seconds to keep stock lists of a concept, they carry live quotes
+_CONCEPT_STOCKS_TTL = 30
+
+# future ids in links of the sina future market page, e.g. quotes/RB2110.shtml
+_FUTURE_RE = re.compile(r'quotes/([^/]*?\d+)\.shtml')
+
+_SINA_TICK = 'https://hq.sinajs.cn/?list='
+# (position, name) of kept fields in a sina tick row
+_SINA_TICK_FIELDS = tuple((j, k) for j, k in enumerate([
+    'name', 'price', 'price_change_rate', 'timesec',
+    'price_change', '_', '_', '_', '_', '_', 'volume', '_', '_',
+    '_', '_', '_', '_', '_', '_', '_', '_', '_', '_', '_', '_',
+    '_', 'last_close', '_', '_', '_', 'turnover', '_', '_', '_', '_']) if k != '_')
 
 
 def make_tgts(mkts=['ch', 'hk', 'us', 'fund', 'future'], money_min=2e8) -> []:
@@ -26,17 +123,9 @@ def get_cn_stock_list(money_min=2e8):
     Return sorted stock list ordered by latest amount of money, cut at `money_min`
     item in returned list are [code, name, change, amount, mktcap]
     '''
-    a = reqget(
-        base64.b64decode('aHR0cDovLzM4LnB1c2gyLmVhc3Rtb25leS5jb20vYXBpL3F0L2Ns'+
-            'aXN0L2dldD9jYj1qUXVlcnkxMTI0MDk0NTg3NjE4NDQzNzQ4MDFfMTYyNzI4ODQ4O'+
-            'Tk2MSZwbj0xJnB6PTEwMDAwJnBvPTEmbnA9MSZ1dD1iZDFkOWRkYjA0MDg5NzAwY2'+
-            'Y5YzI3ZjZmNzQyNjI4MSZmbHR0PTImaW52dD0yJmZpZD1mNiZmcz1tOjArdDo2LG0'+
-            '6MCt0OjgwLG06MSt0OjIsbToxK3Q6MjMmZmllbGRzPWYxMixmMTQsZjMsZjYsZjIxJl89'
-            ).decode() + str(int(time.time()*1e3))
-    )
+    a = reqget(_EAST_CN_STOCKS + _cache_buster())
     if a:
-        a = json.loads(a.text.split(
-            'jQuery112409458761844374801_1627288489961(')[1][:-2])
+        a = _json.loads(_unwrap_jsonp(a.content))
 
     # cdir = os.path.dirname(__file__)
     # with open(os.path.join(cdir, 'ranka'), 'wb') as f:
@@ -72,7 +161,7 @@ def get_us_stocks_biggest(k=60):
         "CallbackList['f0j3ltzVzdo2Fo4p']/US_CategoryService.getList?page=1"+
         "&num=60&sort=&asc=0&market=&id=", headers=WebUtils.headers()).text
     if a:
-        uslist = json.loads(a.split('(',1)[1][:-2])['data']
+        uslist = _json.loads(a.split('(',1)[1][:-2])['data']
         # Warning: symbol not fitted
         uscands = [('us' + i['symbol'], i['name'], i['price'], i['volume'],
             i['mktcap']) for i in uslist]
@@ -84,14 +173,10 @@ def get_cn_fund_list():
     Return sorted etf list (ordered by latest amount of money),
         of [code, name, change, amount, price]
     '''
-    a = reqget(base64.b64decode('aHR0cDovL3ZpcC5zdG9jay5maW5hbmNlLnNpbmEuY29tL'+
-        'mNuL3F1b3Rlc19zZXJ2aWNlL2FwaS9qc29ucC5waHAvSU8uWFNSVjIuQ2FsbGJhY2tMaX'+
-        'N0WydrMldhekswNk5Rd2xoeVh2J10vTWFya2V0X0NlbnRlci5nZXRIUU5vZGVEYXRhU2l'+
-        'tcGxlP3BhZ2U9MSZudW09MTAwMCZzb3J0PWFtb3VudCZhc2M9MCZub2RlPWV0Zl9ocV9m'+
-        'dW5kJiU1Qm9iamVjdCUyMEhUTUxEaXZFbGVtZW50JTVEPXhtNGkw').decode()).text
+    a = reqget(_SINA_CN_FUNDS).text
     if a:
         fundcands = [[i['symbol'], i['name'], i['changepercent'], i['amount'], i['trade']]
-                     for i in json.loads(a.split('k2WazK06NQwlhyXv')[1][3:-2])]
+                     for i in _json.loads(a.split('k2WazK06NQwlhyXv')[1][3:-2])]
     return fundcands
 
 
@@ -107,10 +192,52 @@ def get_cn_future_list():
     a = reqget('https://finance.sina.com.cn/futuremarket/').text
     if a:
         futurelist_active = [
-            'fu' + i for i in re.findall(r'quotes/(.*?\d+).shtml', a)]
+            'fu' + i for i in _FUTURE_RE.findall(a)]
     return futurelist_active
 
 
+@functools.lru_cache(maxsize=1024)
+def _canonical_date(s):
+    '''
+    Return day-grain date string, e.g. 2021-07-01 for '2021-07-01 14:35:00'
+    so that equivalent requests share one url
+    '''
+    if not s:
+        return ''
+    try:
+        return pd.Timestamp(s).strftime('%Y-%m-%d')
+    except (ValueError, TypeError):
+        # leave what we cannot parse to the remote api, as before
+        return s
+
+
+def _cache_buster():
+    '''
+    Return ms timestamp for the `_=` url param, floored to 5 seconds
+    so that repeated list requests can hit the remote cache
+    '''
+    return str(int(time.time() // 5) * 5000)
+
+
+def _unwrap_jsonp(body):
+    '''
+    Return the json part of jsonp bytes `callback({...});`
+    '''
+    return body[body.find(b'(') + 1:body.rfind(b')')]
+
+
+# market prefix of bare cn codes by leading digit
+_CN_PREFIX = {'0': 'sz', '1': 'sz', '3': 'sz', '5': 'sh', '6': 'sh'}
+
+
+@functools.lru_cache(maxsize=4096)
+def _normalize_symbol(i):
+    '''
+    Return symbol with market prefix, e.g. sh600000 for 600000
+    '''
+    return _CN_PREFIX.get(i[0], '') + i
+
+
 def get_price(i, sdate='', edate='', freq='day', days=320, fq='qfq',
               dd=None) -> (str, str, pd.DataFrame):
     '''
@@ -120,107 +247,194 @@ def get_price(i, sdate='', edate='', freq='day', days=320, fq='qfq',
         dd: data dictionary, any local cache with get/put methods
         days: day length of fetching, overwriting sdate
         fq: qfq for non
+    Results are kept in a module-level cache, keyed by all the args:
+        windows reaching today: 30 seconds, so new bars may show up late
+        closed windows: until the next midnight for qfq/hfq, else for good
+        empty results of failed fetches: 5 seconds
+    call clear_cache() to drop them, e.g. before polling for new bars
     '''
     if dd is not None:
         a = dd.get(i)
         if a:
             n, d = a
-            logging.debug('loading price from dd {}'.format(i))
+            logger.debug('loading price from dd %s', i)
             return i, n, d
-    logging.debug('fetching price of {}'.format(i))
-    qtimg_stock = 'http://web.ifzq.gtimg.cn/appstock/app/newfqkline/get?param=' + \
-            '{},{},{},{},{},{}'
-    qtimg_stock_hk = 'http://web.ifzq.gtimg.cn/appstock/app/hkfqkline/get?' + \
-            'param={},{},{},{},{},{}'
-    qtimg_stock_us = 'http://web.ifzq.gtimg.cn/appstock/app/usfqkline/get?' + \
-            'param={},{},{},{},{},{}'
-    sina_future_d = 'https://stock2.finance.sina.com.cn/futures/api/jsonp.php/' + \
-            'var%20t1nf_{}=/InnerFuturesNewService.getDailyKLine?symbol={}'
-    # sina_future_d.format('FB0','FB0')
-
-    if i[:2] == 'BK':
-        try:
-            a = reqget(base64.b64decode('aHR0cDovL3B1c2gyaGlzLmVhc3' +
-                               'Rtb25leS5jb20vYXBpL3F0L3N0b2NrL2tsaW5lL2dldD9jYj1qUX' +
-                               'VlcnkxMTI0MDIyNTY2NDQ1ODczNzY2OTcyXzE2MTc4NjQ1NjgxMz' +
-                               'Emc2VjaWQ9OTAu').decode() + i +
-                          '&fields1=f1%2Cf2%2Cf3%2Cf4%2Cf5' +
-                          '&fields2=f51%2Cf52%2Cf53%2Cf54%2Cf55%2Cf56%2Cf57%2Cf58' +
-                          '&klt=101&fqt=0&beg=19900101&end=20990101&_=1',
-                          headers=WebUtils.headers())
-            if not a:
-                logging.warning('{} reqget failed: {}'.format(i, a))
-                return i, 'None', pd.DataFrame([])
-            a = json.loads(a.text.split(
-                'jQuery1124022566445873766972_1617864568131(')[1][:-2])
-            if not a['data']:
-                logging.warning('{} data empty: {}'.format(i, a))
-                return i, 'None', pd.DataFrame([])
-            name = a['data']['name']
-            d = pd.DataFrame([i.split(',') for i in a['data']['klines']], columns=[
-                             'date', 'open', 'close', 'high', 'low', 'vol', 'money', 'p'])
-            d = d.set_index(['date']).astype(float)
-            # d.index = pd.DatetimeIndex(d.index)
-            return i, name, d
-        except Exception as e:
-            logging.warning('error fetching {}, err: {}'.format(i, e))
-            return i, 'None', pd.DataFrame([])
-
-    if i[:2] == 'fu':
-        try:
-            ix = i[2:] if i[-1]=='0' else i[2:-4]
-            d = pd.DataFrame(json.loads(reqget(sina_future_d.format(
-                    ix, ix)).text.split('(')[1][:-2]))
-            d.columns = ['date', 'open', 'high', 'low', 'close', 'vol', 'p', 's']
-            d = d.set_index(['date']).astype(float)
-            # d.index = pd.DatetimeIndex(d.index)
-            return i, '', d
-        except Exception as e:
-            logging.warning('error get price {}, err {}'.format(i[2:-4], e))
-            return i, 'None', pd.DataFrame([])
-
-    if i[0] in ['0', '1', '3', '5', '6']:
-        i = 'sh'+i if i[0] in ['5', '6'] else 'sz'+i
-    if i[:2] in ['sh', 'sz']:
-        url = qtimg_stock.format(i, freq, sdate, edate, days, fq)
-    elif i[:2] == 'hk':
-        url = qtimg_stock_hk.format(i, freq, sdate, edate, days, fq)
-    elif i[:2] == 'us':
-        url = qtimg_stock_us.format(i, freq, sdate, edate, days, fq)
+    logger.debug('fetching price of %s', i)
+    i = _normalize_symbol(i)
+    sdate, edate = _canonical_date(sdate), _canonical_date(edate)
+    key = (i, sdate, edate, freq, days, fq)
+    a = _price_cache.get(key)
+    if a is not None:
+        # callers may change the frame in place, never hand out the cached one
+        return a[0], a[1], a[2].copy()
+    # concurrent calls of the same request share one fetch
+    a = _price_flight.do(key, _get_price, *key)
+    # only closed windows are final, later ones may still get new bars
+    if len(a[2]):
+        if edate and edate < time.strftime('%Y-%m-%d'):
+            _price_cache.put(key, a, ttl=_secs_to_tomorrow()
+                             if fq in _ADJUSTED_FQ else None)
+        else:
+            _price_cache.put(key, a, ttl=_OPEN_WINDOW_TTL)
     else:
+        _price_cache.put(key, a, ttl=_FAILED_TTL)
+    # waiters of the flight share `a` too, each gets its own copy
+    return a[0], a[1], a[2].copy()
+
+
+def _secs_to_tomorrow():
+    '''
+    Return seconds left until the next local midnight
+    '''
+    t = time.localtime()
+    return 86400 - (t.tm_hour * 3600 + t.tm_min * 60 + t.tm_sec)
+
+
+def clear_cache():
+    '''
+    Drop all cached prices and concepts, later calls fetch afresh
+    '''
+    _price_cache.clear()
+    _concept_cache.clear()
+
+
+def _kline_frame(rows, columns):
+    '''
+    Build a float kline frame of date-first rows, gaps become NaN
+    '''
+    try:
+        a = np.array(rows).reshape(-1, len(columns) + 1)
+        v = a[:, 1:].astype(float)
+    except (ValueError, TypeError):
+        # short rows or null fields, let pandas pad them with NaN
+        return pd.DataFrame(rows, columns=['date'] + columns).set_index(
+            'date').astype(float)
+    return pd.DataFrame(v, index=pd.Index(a[:, 0], name='date'),
+                        columns=columns)
+
+
+def _get_bk_price(i, sdate, edate, freq, days, fq):
+    '''
+    Fetch eastmoney BK board kline
+    '''
+    try:
+        a = reqget(_EAST_BK_KLINE.format(i), headers=WebUtils.headers())
+        if not a:
+            logger.warning('%s reqget failed: %s', i, a)
+            return i, 'None', pd.DataFrame()
+        a = _json.loads(_unwrap_jsonp(a.content))
+        if not a['data']:
+            logger.warning('%s data empty: %s', i, a)
+            return i, 'None', pd.DataFrame()
+        name = a['data']['name']
+        cols = ['open', 'close', 'high', 'low', 'vol', 'money', 'p']
+        d = pd.read_csv(io.StringIO('\n'.join(a['data']['klines'])),
+                        header=None, names=['date'] + cols, index_col='date',
+                        dtype=dict.fromkeys(cols, float))
+        # d.index = pd.DatetimeIndex(d.index)
+        return i, name, DataFormatter.slice_dates(d, sdate, edate)
+    except Exception as e:
+        logger.warning('error fetching %s, err: %s', i, e)
+        return i, 'None', pd.DataFrame()
+
+
+def _get_future_price(i, sdate, edate, freq, days, fq):
+    '''
+    Fetch sina future daily kline
+    '''
+    try:
+        ix = i[2:] if i[-1]=='0' else i[2:-4]
+        body = reqget(_SINA_FUTURE_D.format(ix, ix)).content
+        # records of {d, o, h, l, c, v, p, s}, missing keys read as NaN
+        recs = _json.loads(_unwrap_jsonp(body))
+        d = _kline_frame([[j.get(k) for k in _SINA_FUTURE_KEYS] for j in recs],
+                         ['open', 'high', 'low', 'close', 'vol', 'p', 's'])
+        # d.index = pd.DatetimeIndex(d.index)
+        return i, '', DataFormatter.slice_dates(d, sdate, edate)
+    except Exception as e:
+        logger.warning('error get price %s, err %s', i[2:-4], e)
+        return i, 'None', pd.DataFrame()
+
+
+def _get_qtimg_price(i, sdate, edate, freq, days, fq):
+    '''
+    Fetch tencent kline of sh/sz/hk/us symbols
+    '''
+    url = _QTIMG_KLINE_URLS.get(i[:2])
+    if url is None:
         raise ValueError('target market not supported')
-    a = reqget(url)
+    a = reqget(url.format(i, freq, sdate, edate, days, fq))
     #a = json.loads(a.text.replace('kline_dayqfq=', ''))['data'][i]
-    a = json.loads(a.text)['data'][i]
-    name = ''
+    a = _json.loads(a.content)['data'][i]
+    name, b = '', pd.DataFrame()
+    keys = _QTIMG_KLINE_KEYS_BY_FQ.get(fq, _QTIMG_KLINE_KEYS)
+    tk = next((k for k in keys if k in a), None)
+    if tk is None:
+        logger.warning('no kline of %s in response', i)
+        return i, name, b
     try:
-        for tkt in ['day', 'qfqday', 'hfqday', 'week', 'qfqweek', 'hfqweek',
-                    'month', 'qfqmonth', 'hfqmonth']:
-            if tkt in a:
-                tk = tkt
-                break
-        b = pd.DataFrame([j[:6] for j in a[tk]],
-                         columns=['date',
-                                  'open',
-                                  'close',
-                                  'high',
-                                  'low',
-                                  'vol']).set_index(['date']).astype(float)
+        # rows may carry extra items, e.g. dividend info, keep first 6
+        b = _kline_frame([j[:6] for j in a[tk]],
+                         ['open', 'close', 'high', 'low', 'vol'])
         if 'qt' in a:
             name = a['qt'][i][1]
     except Exception as e:
-        logging.warning('error fetching {}, err: {}'.format(i, e))
+        logger.warning('error fetching %s, err: %s', i, e)
     return i, name, b
 
 
+# market prefix to its fetcher, the rest go to tencent
+_PRICE_HANDLERS = {
+    'BK': _get_bk_price,
+    'fu': _get_future_price,
+}
+
+
+def _get_price(i, sdate, edate, freq, days, fq):
+    '''
+    Fetch price of i from its market source, see get_price
+    '''
+    return _PRICE_HANDLERS.get(i[:2], _get_qtimg_price)(
+        i, sdate, edate, freq, days, fq)
+
+
+def get_prices(ids, sdate='', edate='', freq='day', days=320, fq='qfq',
+               dd=None, workers=8) -> []:
+    '''
+    Batch version of get_price, fetching ids concurrently
+    Return list of (i, name, DataFrame) in the order of ids
+    '''
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        return list(ex.map(
+            lambda i: get_price(i, sdate, edate, freq, days, fq, dd), ids))
+
+
 def get_price_longer(i, l=2, dd={}):
     # default get price 320 day, l as years
-    _, name, a = get_price(i, dd=dd)
-    d1 = a.index.format()[0]
+    # ask for all years in one request (~250 trading days a year), and only
+    # fall back to yearly windows when the source returns fewer rows
+    days = 320 + (l - 1) * 250
+    _, name, a = get_price(i, days=days, dd=dd)
+    if not len(a):
+        return i, name, a
+    d1 = str(a.index[0])[:10]
+    parts, n = [a], len(a)
     for y in range(1, l):
-        d0 = str(int(d1[:4]) - 1) + d1[4:]
-        a = pd.concat((get_price(i, d0, d1)[2], a), 0).drop_duplicates()
+        if n >= days:
+            break
+        d0 = (pd.Timestamp(d1) - pd.DateOffset(years=1)).strftime('%Y-%m-%d')
+        b = get_price(i, d0, d1)[2]
+        # rows older than what we have
+        k = b.index.searchsorted(d1) if len(b) else 0
+        if not k:
+            # nothing older, e.g. before listing
+            break
+        parts.append(b.iloc[:k])
+        n += k
         d1 = d0
+    if len(parts) > 1:
+        # parts are disjoint and each sorted, no dedupe or sort needed
+        a = pd.concat(parts[::-1])
     return i, name, a
 
 
@@ -233,11 +447,6 @@ def get_tick(tgts=[]):
     '''
     if not tgts:
         return []
-    sina_tick = 'https://hq.sinajs.cn/?list='
-    head_row = ['name', 'price', 'price_change_rate', 'timesec',
-        'price_change', '_', '_', '_', '_', '_', 'volume', '_', '_',
-         '_', '_', '_', '_', '_', '_', '_', '_', '_', '_', '_', '_',
-         '_', 'last_close', '_', '_', '_', 'turnover', '_', '_', '_', '_']
 
     if type(tgts) == list:
         tgts = ['gb_' + i.lower() for i in tgts]
@@ -246,17 +455,20 @@ def get_tick(tgts=[]):
     else:
         raise ValueError('tgt should be list or str, e.g. APPL,')
 
-    a = reqget(sina_tick + ','.join(tgts))
+    a = reqget(_SINA_TICK + ','.join(tgts))
     if not a:
-        logging.warning('reqget failed {}'.format(tgts))
+        logger.warning('reqget failed %s', tgts)
         return []
 
     try:
-        dat = [i.split('"')[1].split(',') for i in a.text.split(';\n') if ',' in i]
-        dat_trim = [{k:i[j] for j,k in enumerate(head_row) if k!='_'} for i in dat]
+        # lines of var hq_str_gb_x="f0,f1,...";
+        dat = [i[i.find('"') + 1:i.rfind('"')].split(',')
+               for i in a.text.split(';\n') if ',' in i]
+        dat_trim = [{k:i[j] for j,k in _SINA_TICK_FIELDS} for i in dat]
     except Exception as e:
-        logging.warming('data not complete, check tgt be code str or list without'+
-            ' prefix, your given: {}'.format(tgts))
+        logger.warning('data not complete, check tgt be code str or list without'+
+            ' prefix, your given: %s', tgts)
+        return []
     return dat_trim
 
 
@@ -264,16 +476,18 @@ def get_stock_concepts(i) -> []:
     '''
     Return concept id(start with `BK`) list of a stock, from eastmoney
     '''
-    f10url = base64.b64decode('aHR0cDovL2YxMC5lYXN0bW9uZXkuY29tLy9Db3JlQ29uY2V' +
-                              'wdGlvbi9Db3JlQ29uY2VwdGlvbkFqYXg/Y29kZT0=').decode()
     #drop_cons = ['融资融券', '创业板综', '深股通', '沪股通', '深成500', '长江三角']
     #drop_tails = ['板块', '概念', '0_', '成份', '重仓']
-    url = f10url + i
+    url = _EAST_F10_CONCEPTS + i
+    concepts = _concept_cache.get(url)
+    if concepts is not None:
+        return list(concepts)
     try:
-        concepts = json.loads(reqget(url).text)[
+        concepts = _json.loads(reqget(url).content)[
             'hxtc'][0]['ydnr'].split()
+        _concept_cache.put(url, list(concepts), ttl=_CONCEPT_TTL)
     except Exception as e:
-        logging.error(str(e))
+        logger.error('%s', e)
         concepts = ['']
     #concepts = [i for i in concepts if i not in drop_cons]
     #concepts = [i for i in concepts if i[-2:] not in drop_tails]
@@ -291,34 +505,45 @@ def get_concept_stocks(bkid, dc=None):
         if a:
             return a
     bkid = bkid if isinstance(bkid, str) else 'BK' + str(bkid).zfill(4)
-    a = reqget(
-        base64.b64decode('aHR0cDovL3B1c2gyLmVhc3Rtb25leS5jb20vYXBpL3F0L2NsaXN0' +
-                         'L2dldD9jYj1qUXVlcnkxMTIzMDQwNTcwNTM4NTY5NDcwMTA1XzE2MTgwNDc5OTA2O' +
-                         'TAmZmlkPWY2MiZwbz0xJnB6PTUwMCZwbj0xJm5wPTEmZmx0dD0yJmludnQ9MiZmcz' +
-                         '1iJTNB').decode() +
-        bkid +
-        '&fields=f3%2Cf6%2Cf12%2Cf14%2Cf21').text
-    a = json.loads(
-        a.split('jQuery1123040570538569470105_1618047990690(')[1][:-2])['data']['diff']
-    logging.debug('get fresh conc {}'.format(bkid))
+    a = _concept_cache.get(bkid)
+    if a is not None:
+        return [list(j) for j in a]
+    a = reqget(_EAST_BK_STOCKS.format(bkid)).content
+    a = _json.loads(_unwrap_jsonp(a))['data']['diff']
+    logger.debug('get fresh conc %s', bkid)
     a = [ ['sh'+i['f12'] if i['f12'][0]=='6' else 'sz'+i['f12'],
          i['f14'], i['f3'], i['f6'], i['f21']] for i in a]
+    _concept_cache.put(bkid, [list(j) for j in a], ttl=_CONCEPT_STOCKS_TTL)
     return a
 
 
-def _east_list_fmt(burl, api_name):
+@functools.lru_cache(maxsize=None)
+def _b64url(burl):
+    '''
+    Return url decoded from base64 `burl`, each decoded once
+    '''
+    return base64.b64decode(burl).decode()
+
+
+def _east_list_fmt(burl):
     '''
-    formatter of eastmoney api
+    formatter of eastmoney api, `burl` is base64 of the url
     Return list of list:
         [sid, name, rise, amount, mkt]
     '''
-    a = reqget(base64.b64decode(burl).decode() +
-        str(int(time.time()*1e3)))
+    return _east_list_get(_b64url(burl))
+
+
+def _east_list_get(url):
+    '''
+    same as _east_list_fmt, with plain `url`
+    '''
+    a = reqget(url + _cache_buster())
     if a:
-        a = a.text
+        a = a.content
     else:
         return
-    a = json.loads(a.split(api_name+'(')[1][:-2])['data']['diff']
+    a = _json.loads(_unwrap_jsonp(a))['data']['diff']
     a = [ [i['f12'],i['f14'], i['f3'], i['f6'], i['f20']] for i in a]
     return a
 
@@ -332,9 +557,8 @@ def get_all_industries():
         'zdC9nZXQ/Y2I9alF1ZXJ5MTEyNDAzNzExNzU2NTU3MTk3MTM0NV8xNjI3MDQ3MTg4NTk5'+
         'JnBuPTEmcHo9MTAwJnBvPTEmbnA9MSZ1dD1iZDFkOWRkYjA0MDg5NzAwY2Y5YzI3ZjZmN'+
         'zQyNjI4MSZmbHR0PTImaW52dD0yJmZpZD1mMyZmcz1tOjkwK3Q6MitmOiE1MCZmaWVsZH'+
-        'M9ZjMsZjYsZjEyLGYxNCxmMjAsZjEwNCxmMTA1Jl89',
-        'jQuery1124037117565571971345_1627047188599')
-    logging.debug('get industries {}'.format(len(a)))
+        'M9ZjMsZjYsZjEyLGYxNCxmMjAsZjEwNCxmMTA1Jl89')
+    logger.debug('get industries %d', len(a))
     return a
 
 
@@ -347,25 +571,31 @@ def get_all_concepts():
         'zdC9nZXQ/Y2I9alF1ZXJ5MTEyNDA3MzI5ODQxOTMwNzY4OTc5XzE2MjcxMDk0NjA2MzMm'+
         'cG49MSZwej00MDAmcG89MSZucD0xJnV0PWJkMWQ5ZGRiMDQwODk3MDBjZjljMjdmNmY3N'+
         'DI2MjgxJmZsdHQ9MiZpbnZ0PTImZmlkPWYzJmZzPW06OTArdDozK2Y6ITUwJmZpZWxkcz'+
-        '1mMyxmNixmMTIsZjE0LGYyMCxmMTA0LGYxMDUmXz0='
-        ,'jQuery112407329841930768979_1627109460633')
-    logging.debug('get concepts {}'.format(len(a)))
+        '1mMyxmNixmMTIsZjE0LGYyMCxmMTA0LGYxMDUmXz0=')
+    logger.debug('get concepts %d', len(a))
     return a
 
 
+def _east_bk_fmt(burl, bkid):
+    '''
+    formatter of eastmoney api listing stocks of a bk id,
+    `burl` is base64 of the url prefix ending with `fs=b:`
+    '''
+    url = _b64url(burl) + bkid + \
+        '+f:!50&fields=f3,f6,f12,f14,f20&_='
+    return _east_list_get(url)
+
+
 def get_bk_stocks(bkid):
     '''
     Return stock item list of given bk id,
     item in returned list are [code, name, change, amount, price]
     '''
-    url = base64.b64decode('aHR0cDovLzgyLnB1c2gyLmVhc3Rtb25leS5jb20vYXBpL3F0L2'+
+    a = _east_bk_fmt('aHR0cDovLzgyLnB1c2gyLmVhc3Rtb25leS5jb20vYXBpL3F0L2'+
         'NsaXN0L2dldD9jYj1qUXVlcnkxMTI0MDQ4Njk5NjMwMDk1MTM3NzE0XzE2Mjc0Nzc0OTU'+
         'wNjQmcG49MSZwej0yMDAwJnBvPTAmbnA9MSZ1dD1iZDFkOWRkYjA0MDg5NzAwY2Y5YzI3'+
-        'ZjZmNzQyNjI4MSZmbHR0PTImaW52dD0yJmZpZD1mNiZmcz1iOg==').decode()+ \
-        bkid + '+f:!50&fields=f3,f6,f12,f14,f20&_='
-    a = _east_list_fmt(base64.b64encode(bytes(url, encoding='utf-8')),
-        'jQuery1124048699630095137714_1627477495064')
-    logging.debug('get bk stocks {}'.format(len(a)))
+        'ZjZmNzQyNjI4MSZmbHR0PTImaW52dD0yJmZpZD1mNiZmcz1iOg==', bkid)
+    logger.debug('get bk stocks %d', len(a))
     return a
 
 
@@ -374,30 +604,33 @@ def get_industry_stocks(bkid):
     Return sorted industry item list ordered by latest amount of money,
     item in returned list are [code, name, change, amount, price]
     '''
-    url = base64.b64decode('aHR0cHM6Ly82Mi5wdXNoMi5lYXN0bW9uZXkuY29tL2FwaS9xdC'+
+    a = _east_bk_fmt('aHR0cHM6Ly82Mi5wdXNoMi5lYXN0bW9uZXkuY29tL2FwaS9xdC'+
         '9jbGlzdC9nZXQ/Y2I9alF1ZXJ5MTEyNDA4Mzc4MjAwMDc0NDQ0MzA5XzE2Mjc4MjQ2MDM'+
         '1NjImcG49MSZwej0yMDAwJnBvPTAmbnA9MSZ1dD1iZDFkOWRkYjA0MDg5NzAwY2Y5YzI3'+
-        'ZjZmNzQyNjI4MSZmbHR0PTImaW52dD0yJmZpZD1mNiZmcz1iOg==').decode()+ \
-        bkid + '+f:!50&fields=f3,f6,f12,f14,f20&_='
-    a = _east_list_fmt(base64.b64encode(bytes(url, encoding='utf-8')),
-        'jQuery112408378200074444309_1627824603562')
-    logging.debug('get industry stocks {}'.format(len(a)))
+        'ZjZmNzQyNjI4MSZmbHR0PTImaW52dD0yJmZpZD1mNiZmcz1iOg==', bkid)
+    logger.debug('get industry stocks %d', len(a))
     return a
 
 
+def _east_hk_fmt(burl):
+    '''
+    same as _east_list_fmt, with codes prefixed by `hk`
+    '''
+    a = _east_list_fmt(burl)
+    return [['hk'+i[0], i[1], i[2], i[3], i[4]] for i in a]
+
+
 def get_hk_stocks_ggt():
     '''
     Return sorted stock item list in GangGuTong, ordered by amount of money,
     item in returned list are [code, name, change, amount, price]
     '''
-    a = _east_list_fmt('aHR0cHM6Ly8yLnB1c2gyLmVhc3Rtb25leS5jb20vYXBpL3F0L2NsaX'+
+    a = _east_hk_fmt('aHR0cHM6Ly8yLnB1c2gyLmVhc3Rtb25leS5jb20vYXBpL3F0L2NsaX'+
         'N0L2dldD9jYj1qUXVlcnkxMTI0MDI0MzYyMzA4OTA2NjE1MDgyXzE2MjgyNTg5MzEyMjQ'+
         'mcG49MSZwej0xMDAwJnBvPTAmbnA9MSZ1dD1iZDFkOWRkYjA0MDg5NzAwY2Y5YzI3ZjZm'+
         'NzQyNjI4MSZmbHR0PTImaW52dD0yJmZpZD1mNiZmcz1iOkRMTUswMTQ2LGI6RExNSzAxN'+
-        'DQmZmllbGRzPWYzLGY2LGYxMixmMTQsZjIwJl89',
-        'jQuery1124024362308906615082_1628258931224')
-    a = [ ['hk'+i[0], i[1], i[2], i[3], i[4]] for i in a]
-    logging.debug('get hk stocks GangGuTong {}'.format(len(a)))
+        'DQmZmllbGRzPWYzLGY2LGYxMixmMTQsZjIwJl89')
+    logger.debug('get hk stocks GangGuTong %d', len(a))
     return a
 
 
@@ -406,14 +639,12 @@ def get_hk_stocks_hsi():
     Return sorted stock item list in HSI, ordered by amount of money,
     item in returned list are [code, name, change, amount, price]
     '''
-    a = _east_list_fmt('aHR0cHM6Ly81Ni5wdXNoMi5lYXN0bW9uZXkuY29tL2FwaS9xdC9jbG'+
+    a = _east_hk_fmt('aHR0cHM6Ly81Ni5wdXNoMi5lYXN0bW9uZXkuY29tL2FwaS9xdC9jbG'+
         'lzdC9nZXQ/Y2I9alF1ZXJ5MTEyNDA3ODg4ODY4NDU5NDc5NzkyXzE2MjgyNTk1NjQ2NzE'+
         'mcG49MSZwej0xMDAwJnBvPTEmbnA9MSZ1dD1iZDFkOWRkYjA0MDg5NzAwY2Y5YzI3ZjZm'+
         'NzQyNjI4MSZmbHR0PTImaW52dD0yJmZpZD1mNiZmcz1iOkRMTUswMTQxJmZpZWxkcz1mM'+
-        'yxmNixmMTIsZjE0LGYyMCZfPQ==',
-        'jQuery112407888868459479792_1628259564671')
-    a = [ ['hk'+i[0], i[1], i[2], i[3], i[4]] for i in a]
-    logging.debug('get hk stocks HSI {}'.format(len(a)))
+        'yxmNixmMTIsZjE0LGYyMCZfPQ==')
+    logger.debug('get hk stocks HSI %d', len(a))
     return a
 
 
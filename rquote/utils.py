@@ -6,9 +6,12 @@ import time
 import json
 import random
 import logging
+import functools
+import threading
 import requests
 import numpy as np
 import pandas as pd
+from collections import Counter, OrderedDict
 
 logger = logging.getLogger(__name__)
 hdl = logging.FileHandler('/tmp/rquote.log')
@@ -17,18 +20,26 @@ logger.addHandler(hdl)
 logger.addHandler(logging.StreamHandler())
 logger.setLevel(logging.DEBUG)
 
+# shared by reqget, keeps connections to the quote hosts alive,
+# pool sized for concurrent get_prices workers
+_session = requests.Session()
+_adapter = requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=64)
+_session.mount('http://', _adapter)
+_session.mount('https://', _adapter)
+
 
 class CommonUtils:
-    @staticmethod
-    def rand_string():
-        return ''.join([chr(random.choice(range(97, 123))) for _ in
-                        range(random.choice(range(3, 7)))])
+    _LOWERCASE = 'abcdefghijklmnopqrstuvwxyz'
+
+    @classmethod
+    def rand_string(cls):
+        return ''.join(random.choices(cls._LOWERCASE, k=random.randint(3, 6)))
 
     @staticmethod
+    @functools.lru_cache(maxsize=1024)
     def yesterday_of(day):
         '''return 2020-12-31 if day = 2021-01-01'''
-        return time.strftime('%Y-%m-%d', time.localtime(time.mktime(
-            time.strptime(day, '%Y-%m-%d')) - 24 * 60 * 60))
+        return (pd.Timestamp(day) - pd.Timedelta(days=1)).strftime('%Y-%m-%d')
 
     @staticmethod
     def sample_dates(year_earliest=2010, year_range=2):
@@ -41,22 +52,23 @@ class CommonUtils:
 
 
 class WebUtils:
-    @staticmethod
-    def ua():
-        ua_list = [
-            'Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/30.0.1599.101',
-            'Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/38.0.2125.122',
-            'Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.71',
-            'Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.95',
-            'Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.1 (KHTML, like Gecko) Chrome/21.0.1180.71',
-            'Mozilla/4.0 (compatible; MSIE 6.0; Windows NT 5.1; SV1; QQDownload 732; .NET4.0C; .NET4.0E)',
-            'Mozilla/5.0 (Windows NT 5.1; U; en; rv:1.8.1) Gecko/20061208 Firefox/2.0.0 Opera 9.50',
-            'Mozilla/5.0 (Windows NT 6.1; WOW64; rv:34.0) Gecko/20100101 Firefox/34.0',
-            'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_12_3) AppleWebKit/534.55.3 (KHTML, like Gecko) Version/5.1.5 Safari/534.55.3',
-            'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36',
-            'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/521.61'
-        ]
-        return random.choice(ua_list)
+    _UA_LIST = (
+        'Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/30.0.1599.101',
+        'Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/38.0.2125.122',
+        'Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.71',
+        'Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.95',
+        'Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.1 (KHTML, like Gecko) Chrome/21.0.1180.71',
+        'Mozilla/4.0 (compatible; MSIE 6.0; Windows NT 5.1; SV1; QQDownload 732; .NET4.0C; .NET4.0E)',
+        'Mozilla/5.0 (Windows NT 5.1; U; en; rv:1.8.1) Gecko/20061208 Firefox/2.0.0 Opera 9.50',
+        'Mozilla/5.0 (Windows NT 6.1; WOW64; rv:34.0) Gecko/20100101 Firefox/34.0',
+        'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_12_3) AppleWebKit/534.55.3 (KHTML, like Gecko) Version/5.1.5 Safari/534.55.3',
+        'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36',
+        'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/521.61',
+    )
+
+    @classmethod
+    def ua(cls):
+        return random.choice(cls._UA_LIST)
 
     @classmethod
     def headers(cls):
@@ -80,7 +92,7 @@ class WebUtils:
             else:
                 r = requests.get(url, allow_redirects=True)
         except Exception as e:
-            logger.error('Fetch url {} err: {}'.format(url, e))
+            logger.error('Fetch url %s err: %s', url, e)
             return None
         if r:
             if method == 'text':
@@ -102,10 +114,10 @@ class WebUtils:
                     proxy_type: proxy},
                 timeout=2)
         except Exception as e:
-            logger.info(f'test proxy {proxy} negative')
+            logger.info('test proxy %s negative', proxy)
             return 0
         if r.ok:
-            logger.info(f'test proxy {proxy} positive')
+            logger.info('test proxy %s positive', proxy)
             return 1
 
 
@@ -120,15 +132,12 @@ class BasicFactors:
 
     @staticmethod
     def min_resist(d) -> float:
-        sup, pre, pcur = 0, 0, d.close[-1]
-        for i in d.iterrows():
-            p = (i[1].open + i[1].close) / 2
-            if p > pcur:
-                pre += i[1].vol
-            if p < pcur:
-                sup += i[1].vol
+        pcur = d.close.iloc[-1]
+        p = ((d.open + d.close) / 2).values
+        vol = d.vol.values
+        pre, sup = vol[p > pcur].sum(), vol[p < pcur].sum()
         minres = (sup - pre) / (sup + pre)
-        if abs(minres - 1) < .01 and d.close[-2] < max(d.close[:-2]):
+        if abs(minres - 1) < .01 and d.close.iloc[-2] < max(d.close.iloc[:-2]):
             minres += .2
         minres = round(minres, 2)
         return minres
@@ -207,7 +216,8 @@ class BasicFactors:
     @staticmethod
     def op_cnt(d, cont_min=3) -> (int):
         ''' op: count continous bulling days over index'''
-        d.index = pd.DatetimeIndex(d.index)
+        if not isinstance(d.index, pd.DatetimeIndex):
+            d.index = pd.DatetimeIndex(d.index)
         td = (d.p_change_on_sh.rolling(cont_min).min() > 0).astype(int) * \
             (d.p_change.rolling(cont_min).min() > 0).astype(int)
         ret = 0 if td[-1] <= 0 else td[-1]
@@ -216,6 +226,22 @@ class BasicFactors:
 
 
 class DataFormatter:
+    @staticmethod
+    def slice_dates(d, sdate='', edate=''):
+        '''
+        Return rows of d dated from sdate to edate (both inclusive),
+        d should be sorted by its date index
+        '''
+        if not sdate and not edate:
+            return d
+        idx = d.index
+        lo = idx.searchsorted(sdate, side='left') if sdate else 0
+        hi = idx.searchsorted(edate, side='right') if edate else len(idx)
+        if lo == 0 and hi == len(idx):
+            # window already covers all rows
+            return d
+        return d.iloc[lo:hi]
+
     @staticmethod
     def s_join_sh_close_change(d, dsh=None, sdate='', edate=''):
         '''
@@ -228,7 +254,7 @@ class DataFormatter:
             return d
         d = d.join(dsh[['open', 'close', 'p_change']], rsuffix='_sh').sort_index()
         d['p_change_on_sh'] = d['p_change'] - d['p_change_sh']
-        return d
+        return DataFormatter.slice_dates(d, sdate, edate)
 
     @staticmethod
     def sort_keys_by_cossim(df):
@@ -241,18 +267,18 @@ class DataFormatter:
         keys = list(df.index)
         cs = cosine_similarity(df)
 
-        to_sort_keys = [i for i in keys[1:]]
-        sorted_keys = [keys[0]]
-        
+        # greedy walk to the most similar unvisited key, ties broken by the
+        # descending argsort order as before, visited ones masked out
+        visited = np.zeros(len(keys), dtype=bool)
+        visited[0] = True
+        order = [0]
         cid = 0
-        for i in range(len(keys)-1):
-            for j in np.argsort(cs[cid])[::-1]:
-                if keys[j] not in sorted_keys:
-                    sorted_keys.append(keys[j])
-                    to_sort_keys.remove(keys[j])
-                    cid = j
-                    break
-        return sorted_keys
+        for _ in range(len(keys)-1):
+            cands = np.argsort(cs[cid])[::-1]
+            cid = int(cands[~visited[cands]][0])
+            visited[cid] = True
+            order.append(cid)
+        return [keys[j] for j in order]
 
     @staticmethod
     def join_stock_concepts(nhe, nhb, dc):
@@ -263,7 +289,6 @@ class DataFormatter:
         dc: dict of concept {concept: [stock]}
         TODO abstract it
         '''
-        from collections import Counter
         nhb.index = nhb.sid
         nhe.index = nhe.sname
         nhe['conc'] = ''
@@ -299,17 +324,94 @@ class DataFormatter:
 
 class reqget:
     '''
-    class version request.get wrapper
+    class version request.get wrapper,
+    `session` defaults to the module shared one
     '''
-    def __init__(self, url, *args, **kwargs):
+    __slots__ = ('url', 'r', 'content')
+
+    def __init__(self, url, *args, session=None, **kwargs):
         self.url = url
         try:
-            self.r = requests.get(
+            self.r = (session or _session).get(
                 self.url, allow_redirects=True, *args, **kwargs)
-            self.text = self.r.text
             self.content = self.r.content
         except BaseException:
-            logger.error(f'fetch {self.url} err')
-            self.text = ''
+            logger.error('fetch %s err', self.url)
+            self.r = None
             self.content = b''
 
+    @property
+    def text(self):
+        '''
+        decoded body, only built when asked for, json paths read content
+        '''
+        return self.r.text if self.r is not None else ''
+
+
+class LRUCache:
+    '''
+    Size bounded in-process cache with get/put,
+    least recently used items are dropped first,
+    items put with ttl (seconds) expire after it
+    '''
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        # key: (value, expire time or None)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            if item[1] is not None and item[1] < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return item[0]
+
+    def put(self, key, value, ttl=None):
+        expire = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            self._data[key] = (value, expire)
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class SingleFlight:
+    '''
+    Run at most one call per key at a time,
+    concurrent callers of the same key wait for and share its result
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                # [done event, result, exception]
+                call = self._calls[key] = [threading.Event(), None, None]
+        if not leader:
+            call[0].wait()
+            if call[2] is not None:
+                raise call[2]
+            return call[1]
+        try:
+            call[1] = func(*args, **kwargs)
+        except BaseException as e:
+            call[2] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call[0].set()
+        return call[1]